@@ -1,12 +1,26 @@
+import logging
+import time
+
 import httpx
 from core.config import (
     AZURE_OPENAI_ENDPOINT,
     AZURE_OPENAI_API_KEY,
     AZURE_OPENAI_DEPLOYMENT,
     AZURE_OPENAI_API_VERSION,
+    AZURE_OPENAI_CONTEXT_TOKENS,
 )
+from core.deadline import stage_timeout
+from core.tokens import estimate_chat_tokens, completion_timeout_s, MIN_OUTPUT_TOKENS
+
+logger = logging.getLogger(__name__)
+
 
-async def call_azure_openai(prompt: str) -> str:
+async def call_azure_openai_with_usage(prompt: str, max_tokens: int = 3000) -> tuple[str, dict]:
+    """
+    Returns:
+        (content, usage) where usage has prompt/completion token counts
+        (as reported by Azure), the local prompt estimate, max_tokens and latency.
+    """
     endpoint = (AZURE_OPENAI_ENDPOINT or "").rstrip("/")
     url = f"{endpoint}/openai/deployments/{AZURE_OPENAI_DEPLOYMENT}/chat/completions"
     params = {"api-version": AZURE_OPENAI_API_VERSION}
@@ -16,18 +30,58 @@ async def call_azure_openai(prompt: str) -> str:
         "Content-Type": "application/json",
     }
 
+    messages = [
+        {"role": "system", "content": "You are an expert educational content creator."},
+        {"role": "user", "content": prompt},
+    ]
+
+    # Catch oversized prompts locally instead of a 400 from the deployment
+    estimated_prompt_tokens = estimate_chat_tokens(messages)
+    available = AZURE_OPENAI_CONTEXT_TOKENS - estimated_prompt_tokens
+    if available < MIN_OUTPUT_TOKENS:
+        raise RuntimeError(
+            f"Prompt too large: ~{estimated_prompt_tokens} tokens, "
+            f"context limit is {AZURE_OPENAI_CONTEXT_TOKENS}"
+        )
+    if max_tokens > available:
+        logger.warning(
+            "Shrinking max_tokens %s -> %s to fit context (prompt ~%s tokens)",
+            max_tokens, available, estimated_prompt_tokens,
+        )
+        max_tokens = available
+
     payload = {
-        "messages": [
-            {"role": "system", "content": "You are an expert educational content creator."},
-            {"role": "user", "content": prompt},
-        ],
+        "messages": messages,
         "temperature": 0.4,
-        "max_tokens": 3000,
+        "max_tokens": max_tokens,
     }
 
-    async with httpx.AsyncClient(timeout=60) as client:
+    started = time.monotonic()
+    async with httpx.AsyncClient(timeout=stage_timeout(completion_timeout_s(max_tokens))) as client:
         response = await client.post(url, headers=headers, params=params, json=payload)
         response.raise_for_status()
         data = response.json()
+    latency_ms = int((time.monotonic() - started) * 1000)
+
+    choice = data["choices"][0]
+    reported = data.get("usage") or {}
+    usage = {
+        "deployment": AZURE_OPENAI_DEPLOYMENT,
+        "prompt_tokens": reported.get("prompt_tokens"),
+        "completion_tokens": reported.get("completion_tokens"),
+        "total_tokens": reported.get("total_tokens"),
+        "estimated_prompt_tokens": estimated_prompt_tokens,
+        "max_tokens": max_tokens,
+        "finish_reason": choice.get("finish_reason"),
+        "latency_ms": latency_ms,
+    }
+
+    if usage["finish_reason"] == "length":
+        logger.warning("Azure OpenAI output truncated at max_tokens=%s", max_tokens)
+
+    return choice["message"]["content"], usage
+
 
-    return data["choices"][0]["message"]["content"]
+async def call_azure_openai(prompt: str, max_tokens: int = 3000) -> str:
+    content, _usage = await call_azure_openai_with_usage(prompt, max_tokens=max_tokens)
+    return content
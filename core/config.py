@@ -13,6 +13,18 @@ def env(name: str, default: str | None = None) -> str | None:
         return None
     return str(v).strip()
 
+def env_int(name: str, default: int) -> int:
+    """
+    Integer setting; falls back to default when unset/blank/invalid.
+    """
+    v = env(name)
+    if not v:
+        return default
+    try:
+        return int(v)
+    except ValueError:
+        return default
+
 # -----------------------
 # Supabase
 # -----------------------
@@ -27,8 +39,46 @@ AZURE_OPENAI_API_KEY = env("AZURE_OPENAI_API_KEY")
 AZURE_OPENAI_DEPLOYMENT = env("AZURE_OPENAI_DEPLOYMENT")
 AZURE_OPENAI_API_VERSION = env("AZURE_OPENAI_API_VERSION")
 
+# Deployment limits used for local prompt sizing (tokens).
+# Defaults match gpt-4o (128k context, 16,384 output); set them to your deployment's.
+AZURE_OPENAI_CONTEXT_TOKENS = env_int("AZURE_OPENAI_CONTEXT_TOKENS", 128000)
+AZURE_OPENAI_MAX_OUTPUT_TOKENS = env_int("AZURE_OPENAI_MAX_OUTPUT_TOKENS", 16384)
+# Slowest generation speed we plan for (tokens/s). Completions are not
+# streamed, so the HTTP timeout must cover the whole max_tokens budget.
+AZURE_OPENAI_MIN_TOKENS_PER_S = env_int("AZURE_OPENAI_MIN_TOKENS_PER_S", 25)
+
+# "single" = one completion for all sections
+# "parallel" = outline first, then one concurrent completion per section
+SCRIPT_GENERATION_MODE = (env("SCRIPT_GENERATION_MODE", "single") or "single").lower()
+
 # -----------------------
 # Azure Speech (TTS)
 # -----------------------
 AZURE_SPEECH_KEY = env("AZURE_SPEECH_KEY")
 AZURE_SPEECH_REGION = env("AZURE_SPEECH_REGION")
+
+# Avatar video: max sanitized chars per synthesis segment, and how many
+# batch syntheses may run at once for one lecture
+AVATAR_SEGMENT_MAX_CHARS = env_int("AVATAR_SEGMENT_MAX_CHARS", 3000)
+AVATAR_MAX_CONCURRENCY = env_int("AVATAR_MAX_CONCURRENCY", 2)
+
+# -----------------------
+# Request deadlines (seconds, whole pipeline per request)
+# -----------------------
+# Script: material downloads + a full-cap completion at AZURE_OPENAI_MIN_TOKENS_PER_S
+SCRIPT_REQUEST_DEADLINE_S = env_int("SCRIPT_REQUEST_DEADLINE_S", 900)
+CONTENT_REQUEST_DEADLINE_S = env_int("CONTENT_REQUEST_DEADLINE_S", 1800)
+
+# -----------------------
+# Material downloads
+# -----------------------
+# Hard cap per material; larger files are rejected before/while downloading
+MATERIAL_MAX_BYTES = env_int("MATERIAL_MAX_BYTES", 50 * 1024 * 1024)
+# Downloads up to this size stay in memory, bigger ones spill to a temp file
+MATERIAL_SPOOL_MEMORY_BYTES = env_int("MATERIAL_SPOOL_MEMORY_BYTES", 4 * 1024 * 1024)
+
+# -----------------------
+# Material ingestion webhook
+# -----------------------
+# Shared secret expected in the X-Webhook-Secret header (unset = no check)
+MATERIAL_INGEST_WEBHOOK_SECRET = env("MATERIAL_INGEST_WEBHOOK_SECRET")
@@ -0,0 +1,113 @@
+import asyncio
+import contextvars
+import time
+from typing import Awaitable, TypeVar
+
+T = TypeVar("T")
+
+# How often a running request checks whether its client went away (seconds)
+DISCONNECT_POLL_S = 1.0
+
+
+class DeadlineExceeded(RuntimeError):
+    pass
+
+
+class RequestAborted(RuntimeError):
+    pass
+
+
+class Deadline:
+    """
+    Time budget for one request. Every stage asks it for its own timeout
+    (capped by the stage's usual limit) instead of using a fixed one.
+    """
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+        # Set when the pipeline is cancelled, so in-flight jobs can say why
+        self.cancel_reason: str | None = None
+
+    def remaining(self) -> float:
+        return self.expires_at - time.monotonic()
+
+    def check(self):
+        if self.remaining() <= 0:
+            raise DeadlineExceeded(f"Request deadline of {self.seconds:g}s exceeded")
+
+    def timeout(self, cap: float) -> float:
+        self.check()
+        return min(cap, self.remaining())
+
+
+_current_deadline: contextvars.ContextVar[Deadline | None] = contextvars.ContextVar(
+    "current_deadline", default=None
+)
+
+
+def current_deadline() -> Deadline | None:
+    return _current_deadline.get()
+
+
+def stage_timeout(cap: float) -> float:
+    """
+    Timeout for the next stage: cap, or less if the request budget is nearly spent.
+    Raises DeadlineExceeded when nothing is left.
+    """
+    deadline = current_deadline()
+    return cap if deadline is None else deadline.timeout(cap)
+
+
+def check_deadline():
+    deadline = current_deadline()
+    if deadline is not None:
+        deadline.check()
+
+
+def cancel_reason(default: str = "cancelled") -> str:
+    deadline = current_deadline()
+    return (deadline.cancel_reason if deadline else None) or default
+
+
+async def run_with_deadline(coro: Awaitable[T], seconds: float, request=None) -> T:
+    """
+    Runs coro under a Deadline of `seconds`, visible to every stage through
+    current_deadline(). The work is cancelled when the budget runs out
+    (DeadlineExceeded) or when `request`'s client disconnects (RequestAborted).
+    """
+    deadline = Deadline(seconds)
+    token = _current_deadline.set(deadline)
+    try:
+        # The task copies the current context, so it sees the deadline
+        task = asyncio.ensure_future(coro)
+    finally:
+        _current_deadline.reset(token)
+
+    aborted = False
+    try:
+        while not task.done():
+            remaining = deadline.remaining()
+            if remaining <= 0:
+                deadline.cancel_reason = f"Request deadline of {seconds:g}s exceeded"
+                break
+            await asyncio.wait({task}, timeout=min(DISCONNECT_POLL_S, remaining))
+            if not task.done() and request is not None and await request.is_disconnected():
+                deadline.cancel_reason = "Client disconnected"
+                aborted = True
+                break
+    except asyncio.CancelledError:
+        deadline.cancel_reason = deadline.cancel_reason or "Request cancelled"
+        task.cancel()
+        raise
+
+    if task.done():
+        return task.result()
+
+    # Let the pipeline run its cancellation handlers (mark jobs failed etc.)
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+
+    if aborted:
+        raise RequestAborted(deadline.cancel_reason)
+    raise DeadlineExceeded(deadline.cancel_reason)
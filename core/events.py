@@ -0,0 +1,122 @@
+import asyncio
+import itertools
+import time
+from collections import deque
+
+# Events kept per lecture for Last-Event-ID resume
+HISTORY_SIZE = 500
+# A finished lecture's history is dropped this long after its last event
+# (once nobody is subscribed)
+HISTORY_TTL_S = 600
+TERMINAL_EVENTS = {"complete", "cancelled"}
+
+
+class JobSubscription:
+    """
+    One listener on a lecture's job events (SSE / WebSocket connection).
+    Replays history newer than last_event_id first, then live events.
+    """
+
+    def __init__(self, bus: "JobEventBus", lecture_id: str, last_event_id: int | None):
+        self._bus = bus
+        self._lecture_id = lecture_id
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._last_id = last_event_id or 0
+        # Register before replaying so nothing published in between is lost;
+        # duplicates are dropped by id in get().
+        bus._subscribers.setdefault(lecture_id, set()).add(self._queue)
+        self._backlog = deque(bus.replay(lecture_id, last_event_id)) if last_event_id is not None else deque()
+
+    async def get(self, timeout: float | None = None) -> dict | None:
+        """
+        Next event, or None if nothing arrived within timeout (send a keepalive).
+        """
+        if self._backlog:
+            event = self._backlog.popleft()
+            self._last_id = event["id"]
+            return event
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                event = await asyncio.wait_for(self._queue.get(), remaining)
+            except asyncio.TimeoutError:
+                return None
+            if event["id"] > self._last_id:
+                self._last_id = event["id"]
+                return event
+
+    def close(self) -> None:
+        subs = self._bus._subscribers.get(self._lecture_id)
+        if subs is not None:
+            subs.discard(self._queue)
+            if not subs:
+                self._bus._subscribers.pop(self._lecture_id, None)
+
+
+class JobEventBus:
+    """
+    In-process pub/sub for lecture job state/progress, keyed by lecture_id.
+
+    Single-process only: with several workers, a client only sees jobs run
+    by the worker it is connected to.
+    """
+
+    def __init__(self, history_size: int = HISTORY_SIZE, history_ttl_s: float = HISTORY_TTL_S):
+        # Seeded from wall clock so ids keep increasing across restarts
+        self._ids = itertools.count(int(time.time() * 1000))
+        self._history_size = history_size
+        self._history_ttl_s = history_ttl_s
+        self._history: dict[str, deque] = {}
+        self._subscribers: dict[str, set[asyncio.Queue]] = {}
+
+    def publish(self, lecture_id: str, event_type: str, data: dict) -> dict:
+        event = {"id": next(self._ids), "event": event_type, "data": data}
+        history = self._history.get(lecture_id)
+        if history is None:
+            history = self._history[lecture_id] = deque(maxlen=self._history_size)
+        history.append(event)
+        for queue in self._subscribers.get(lecture_id, ()):
+            queue.put_nowait(event)
+        if event_type in TERMINAL_EVENTS:
+            self._schedule_expiry(lecture_id, event["id"])
+        return event
+
+    def _schedule_expiry(self, lecture_id: str, event_id: int):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        loop.call_later(self._history_ttl_s, self._expire, lecture_id, event_id)
+
+    def _expire(self, lecture_id: str, event_id: int):
+        history = self._history.get(lecture_id)
+        if not history or history[-1]["id"] != event_id:
+            # Gone already, or the lecture got new events (a later run reschedules)
+            return
+        if self._subscribers.get(lecture_id):
+            self._schedule_expiry(lecture_id, event_id)
+            return
+        self._history.pop(lecture_id, None)
+
+    def can_resume(self, lecture_id: str, last_event_id: int) -> bool:
+        """
+        True if last_event_id is still in this process's history for the
+        lecture, i.e. nothing after it was evicted. Unknown ids (restart,
+        another worker, evicted) need a fresh snapshot instead.
+        """
+        history = self._history.get(lecture_id) or ()
+        return any(e["id"] == last_event_id for e in history)
+
+    def replay(self, lecture_id: str, last_event_id: int | None) -> list[dict]:
+        history = self._history.get(lecture_id) or ()
+        if last_event_id is None:
+            return list(history)
+        return [e for e in history if e["id"] > last_event_id]
+
+    def subscribe(self, lecture_id: str, last_event_id: int | None = None) -> JobSubscription:
+        return JobSubscription(self, lecture_id, last_event_id)
+
+
+job_events = JobEventBus()
@@ -0,0 +1,82 @@
+import math
+
+from core.config import AZURE_OPENAI_MAX_OUTPUT_TOKENS, AZURE_OPENAI_MIN_TOKENS_PER_S
+
+# Rough GPT tokenizer ratio for English prose (no tokenizer dependency needed)
+CHARS_PER_TOKEN = 4
+# Chat format overhead per message (role, separators)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# Narration pace ~150 words/min, ~1.35 tokens/word
+SPOKEN_TOKENS_PER_MINUTE = 200
+# Slides: roughly one slide per minute, ~60 tokens per slide
+SLIDE_TOKENS_PER_MINUTE = 60
+
+MIN_OUTPUT_TOKENS = 256
+HEADROOM = 1.2  # markdown, headers, model verbosity
+
+
+def estimate_tokens(text: str) -> int:
+    if not text:
+        return 0
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def estimate_chat_tokens(messages: list[dict]) -> int:
+    return sum(
+        estimate_tokens(m.get("content") or "") + MESSAGE_OVERHEAD_TOKENS
+        for m in messages
+    ) + 2
+
+
+def _clamp_output(tokens: float) -> int:
+    return max(MIN_OUTPUT_TOKENS, min(AZURE_OPENAI_MAX_OUTPUT_TOKENS, int(tokens)))
+
+
+def required_tokens_for_section(mode: str, video_length: int) -> int:
+    """
+    Unclamped output estimate for one VIDEO/AUDIO/PPT section of `video_length` minutes.
+    """
+    minutes = max(1, int(video_length or 1))
+    per_minute = SLIDE_TOKENS_PER_MINUTE if mode == "powerpoint" else SPOKEN_TOKENS_PER_MINUTE
+    return int(minutes * per_minute * HEADROOM)
+
+
+def required_tokens_for_script(video_length: int, selected_modes: list[str]) -> int:
+    """
+    Unclamped output estimate for the single-call script (TITLE + every selected section).
+    """
+    minutes = max(1, int(video_length or 1))
+    total = 50  # TITLE + section headers
+    for mode in selected_modes:
+        per_minute = SLIDE_TOKENS_PER_MINUTE if mode == "powerpoint" else SPOKEN_TOKENS_PER_MINUTE
+        total += minutes * per_minute
+    return int(total * HEADROOM)
+
+
+def exceeds_output_cap(required_tokens: int) -> bool:
+    return required_tokens > AZURE_OPENAI_MAX_OUTPUT_TOKENS
+
+
+def max_tokens_for_section(mode: str, video_length: int) -> int:
+    return _clamp_output(required_tokens_for_section(mode, video_length))
+
+
+def max_tokens_for_outline(video_length: int) -> int:
+    minutes = max(1, int(video_length or 1))
+    return _clamp_output(200 + minutes * 40)
+
+
+def max_tokens_for_script(video_length: int, selected_modes: list[str]) -> int:
+    return _clamp_output(required_tokens_for_script(video_length, selected_modes))
+
+
+# Connection + prompt processing before the first output token
+LLM_BASE_TIMEOUT_S = 30
+
+
+def completion_timeout_s(max_tokens: int) -> float:
+    """
+    HTTP timeout for a non-streamed completion of up to max_tokens.
+    """
+    return LLM_BASE_TIMEOUT_S + max_tokens / max(1, AZURE_OPENAI_MIN_TOKENS_PER_S)
@@ -1,6 +1,7 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from routes.lectures import router as lecture_router
+from routes.materials import router as material_router
 
 app = FastAPI(title="GenAI-ED Backend")
 
@@ -15,6 +16,7 @@ app.add_middleware(
 )
 
 app.include_router(lecture_router, prefix="/api")
+app.include_router(material_router, prefix="/api")
 
 @app.get("/")
 def root():
@@ -1,21 +1,71 @@
-from fastapi import APIRouter, HTTPException
+import json
+
+from fastapi import APIRouter, HTTPException, Query, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
+from core.config import SCRIPT_REQUEST_DEADLINE_S, CONTENT_REQUEST_DEADLINE_S
+from core.deadline import run_with_deadline, DeadlineExceeded, RequestAborted
+from core.events import job_events
 from services.script_generator import generate_script
-from services.content_generator import generate_content_for_lecture
+from services.content_generator import generate_content_for_lecture, get_job_snapshot, open_audio_preview
 
 router = APIRouter(prefix="/lectures", tags=["lectures"])
 
+# Seconds between keepalives on idle job streams (keeps proxies from closing them)
+STREAM_KEEPALIVE_S = 15
+
+
+def _parse_last_event_id(value: str | None) -> int | None:
+    if not value:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        return None
+
+
+def _resumable_from(lecture_id: str, last_event_id: int | None) -> int | None:
+    """
+    last_event_id if the bus can replay everything after it, else None
+    (the client then gets a fresh snapshot instead of silently missing events).
+    """
+    if last_event_id is None or not job_events.can_resume(lecture_id, last_event_id):
+        return None
+    return last_event_id
+
+
+def _sse(event: str, data, event_id: int | None = None) -> str:
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event}")
+    lines.append(f"data: {json.dumps(data, default=str)}")
+    return "\n".join(lines) + "\n\n"
+
+
 @router.post("/{lecture_id}/generate-script")
-async def generate_lecture_script(lecture_id: str):
+async def generate_lecture_script(lecture_id: str, request: Request):
     try:
-        script = await generate_script(lecture_id)
+        script = await run_with_deadline(generate_script(lecture_id), SCRIPT_REQUEST_DEADLINE_S, request)
         return {"status": "success", "script": script}
+    except DeadlineExceeded as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    except RequestAborted as e:
+        # Nobody is listening any more; status only shows up in access logs
+        raise HTTPException(status_code=499, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/{lecture_id}/generate-content")
-async def generate_lecture_content(lecture_id: str):
+async def generate_lecture_content(lecture_id: str, request: Request, resume: bool = False):
+    """
+    ?resume=true re-runs only failed / missing jobs of the previous run.
+    """
     try:
-        result = await generate_content_for_lecture(lecture_id)
+        result = await run_with_deadline(
+            generate_content_for_lecture(lecture_id, resume=resume),
+            CONTENT_REQUEST_DEADLINE_S,
+            request,
+        )
 
         if result is None:
             raise HTTPException(
@@ -33,5 +83,86 @@ async def generate_lecture_content(lecture_id: str):
 
     except HTTPException:
         raise
+    except DeadlineExceeded as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    except RequestAborted as e:
+        raise HTTPException(status_code=499, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/{lecture_id}/audio/preview")
+async def preview_lecture_audio(lecture_id: str, save: bool = False, max_chars: int | None = Query(None, ge=1)):
+    """
+    Chunked MP3 of the AUDIO SCRIPT, streamed as Azure synthesizes it.
+    ?save=true also stores the result as the audio artifact; ?max_chars=
+    previews an excerpt (excerpts are never stored).
+    """
+    try:
+        chunks = await open_audio_preview(lecture_id, save=save, max_chars=max_chars)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    return StreamingResponse(
+        chunks,
+        media_type="audio/mpeg",
+        headers={"Cache-Control": "no-store", "X-Accel-Buffering": "no"},
+    )
+
+@router.get("/{lecture_id}/jobs/stream")
+async def stream_lecture_jobs(lecture_id: str, request: Request, last_event_id: str | None = None):
+    """
+    Server-Sent Events: job state transitions + progress for this lecture.
+    Resumes from the Last-Event-ID header (or ?last_event_id=); a fresh
+    connection, or one whose id can no longer be replayed, starts with a
+    "snapshot" of the current lecture_jobs rows.
+    """
+    resume_from = _resumable_from(
+        lecture_id, _parse_last_event_id(request.headers.get("last-event-id") or last_event_id)
+    )
+
+    async def events():
+        # Registered only once the body is iterated, and always closed:
+        # a response that is never sent must not leave a queue behind.
+        # Subscribe before reading the snapshot so no transition falls in between.
+        subscription = job_events.subscribe(lecture_id, resume_from)
+        try:
+            if resume_from is None:
+                yield _sse("snapshot", {"jobs": get_job_snapshot(lecture_id)})
+            while not await request.is_disconnected():
+                event = await subscription.get(timeout=STREAM_KEEPALIVE_S)
+                if event is None:
+                    yield ": keepalive\n\n"
+                    continue
+                yield _sse(event["event"], event["data"], event["id"])
+        finally:
+            subscription.close()
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@router.websocket("/{lecture_id}/jobs/ws")
+async def websocket_lecture_jobs(websocket: WebSocket, lecture_id: str):
+    """
+    WebSocket fallback for /jobs/stream; same events as JSON messages
+    {"id", "event", "data"}. Resume with ?last_event_id=.
+    """
+    await websocket.accept()
+    resume_from = _resumable_from(lecture_id, _parse_last_event_id(websocket.query_params.get("last_event_id")))
+    subscription = job_events.subscribe(lecture_id, resume_from)
+
+    try:
+        if resume_from is None:
+            await websocket.send_json({"id": None, "event": "snapshot", "data": {"jobs": get_job_snapshot(lecture_id)}})
+        while True:
+            event = await subscription.get(timeout=STREAM_KEEPALIVE_S)
+            if event is None:
+                await websocket.send_json({"id": None, "event": "ping", "data": {}})
+                continue
+            await websocket.send_json(json.loads(json.dumps(event, default=str)))
+    except WebSocketDisconnect:
+        pass
+    finally:
+        subscription.close()
@@ -0,0 +1,66 @@
+import hmac
+
+from fastapi import APIRouter, BackgroundTasks, HTTPException, Request
+from core.config import MATERIAL_INGEST_WEBHOOK_SECRET
+from services.material_ingestion import (
+    ingest_material,
+    ingest_lecture_materials,
+    is_in_flight,
+    STATUS_SUCCEEDED,
+)
+
+router = APIRouter(prefix="/materials", tags=["materials"])
+
+
+def _check_webhook_secret(request: Request):
+    if not MATERIAL_INGEST_WEBHOOK_SECRET:
+        return
+    provided = request.headers.get("x-webhook-secret") or ""
+    if not hmac.compare_digest(provided, MATERIAL_INGEST_WEBHOOK_SECRET):
+        raise HTTPException(status_code=401, detail="Invalid webhook secret")
+
+
+@router.post("/ingest", status_code=202)
+async def ingest_material_webhook(request: Request, background_tasks: BackgroundTasks):
+    """
+    Database webhook for new lecture_materials rows.
+    Accepts a Supabase database webhook INSERT payload ({"type", "table", "record"})
+    or a plain {"material_id": ...}. Extraction runs in the background.
+
+    Only INSERTs are handled: ingestion itself updates the row, so reacting
+    to UPDATE webhooks would re-trigger it forever.
+    """
+    _check_webhook_secret(request)
+
+    try:
+        body = await request.json()
+    except Exception:
+        raise HTTPException(status_code=400, detail="Expected a JSON body")
+
+    if not isinstance(body, dict):
+        raise HTTPException(status_code=400, detail="Expected a JSON object")
+
+    if "material_id" in body:
+        material_id = body.get("material_id")
+    else:
+        if body.get("type") != "INSERT" or body.get("table") not in (None, "lecture_materials"):
+            return {"status": "ignored"}
+        record = body.get("record") or {}
+        if record.get("extraction_status") == STATUS_SUCCEEDED or is_in_flight(record):
+            return {"status": "ignored"}
+        material_id = record.get("id")
+
+    if not material_id:
+        raise HTTPException(status_code=400, detail="Missing material_id / record.id")
+
+    background_tasks.add_task(ingest_material, str(material_id))
+    return {"status": "accepted", "material_id": material_id}
+
+
+@router.post("/lectures/{lecture_id}/ingest", status_code=202)
+async def ingest_lecture_materials_endpoint(lecture_id: str, background_tasks: BackgroundTasks):
+    """
+    Pre-extracts every not-yet-ingested material of a lecture in the background.
+    """
+    background_tasks.add_task(ingest_lecture_materials, lecture_id)
+    return {"status": "accepted", "lecture_id": lecture_id}
@@ -0,0 +1,41 @@
+import hashlib
+import json
+
+# Content-hashed paths never change content, so CDNs can cache them forever.
+# storage3 prefixes the value with "max-age=", so the stored header becomes
+# "max-age=31536000, immutable".
+IMMUTABLE_CACHE_CONTROL = "31536000, immutable"
+
+
+def compute_input_hash(artifact_type: str, generator_version: str, **inputs) -> str:
+    """
+    Stable sha256 over everything that determines an artifact's bytes.
+    Bump the generator's *_GENERATOR_VERSION when its output format changes.
+    """
+    payload = {
+        "artifact_type": artifact_type,
+        "generator_version": generator_version,
+        "inputs": inputs,
+    }
+    raw = json.dumps(payload, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def artifact_storage_path(educator_id: str, lecture_id: str, name: str, ext: str, input_hash: str | None) -> str:
+    """
+    "{educator}/{lecture}/artifacts/{name}-{hash16}.{ext}" when hashed,
+    otherwise the legacy mutable "{name}.{ext}" path.
+    """
+    if input_hash:
+        return f"{educator_id}/{lecture_id}/artifacts/{name}-{input_hash[:16]}.{ext}"
+    return f"{educator_id}/{lecture_id}/artifacts/{name}.{ext}"
+
+
+def upload_file_options(content_type: str, input_hash: str | None) -> dict:
+    options = {
+        "content-type": content_type,
+        "x-upsert": "true",
+    }
+    if input_hash:
+        options["cache-control"] = IMMUTABLE_CACHE_CONTROL
+    return options
@@ -1,5 +1,6 @@
 # audio_generator.py
 import re
+from typing import AsyncIterator
 from xml.sax.saxutils import escape
 
 import httpx
@@ -11,11 +12,20 @@ from core.config import (
     AZURE_SPEECH_KEY,
     AZURE_SPEECH_REGION,
 )
+from core.deadline import stage_timeout
+from services.artifact_hash import compute_input_hash, artifact_storage_path, upload_file_options
 
 supabase = create_client(SUPABASE_URL, SUPABASE_SERVICE_KEY)
 
 _TAG_RE = re.compile(r"<[^>]+>")  # strips any HTML/XML-like tags
 
+DEFAULT_VOICE_NAME = "en-US-AvaMultilingualNeural"
+OUTPUT_FORMAT = "audio-16khz-128kbitrate-mono-mp3"
+STREAM_CHUNK_BYTES = 4096
+
+# Bump when SSML building / output format changes (invalidates input hashes)
+AUDIO_GENERATOR_VERSION = "1"
+
 
 def _sanitize_for_ssml(text: str) -> str:
     """
@@ -39,17 +49,20 @@ def _extract_audio_script(script_text: str) -> str:
     return (script_text or "").strip()
 
 
-async def generate_audio_tts_and_upload(
-    lecture_id: str,
-    educator_id: str,
-    script_text: str,
-    voice_name: str = "en-US-AvaMultilingualNeural",
-) -> tuple[str, str]:
-    """
-    Generates TTS audio using Azure Speech and uploads to Supabase Storage.
+def audio_input_hash(script_text: str, voice_name: str = DEFAULT_VOICE_NAME) -> str:
+    return compute_input_hash(
+        "audio",
+        AUDIO_GENERATOR_VERSION,
+        text=_extract_audio_script(script_text),
+        voice_name=voice_name,
+        output_format=OUTPUT_FORMAT,
+    )
 
+
+def _build_tts_request(text: str, voice_name: str) -> tuple[str, dict, bytes]:
+    """
     Returns:
-        (public_url, storage_path)
+        (tts_url, headers, ssml_bytes)
     """
     # ---- Validate config early ----
     if not isinstance(AZURE_SPEECH_KEY, str) or not AZURE_SPEECH_KEY.strip():
@@ -57,10 +70,6 @@ async def generate_audio_tts_and_upload(
     if not isinstance(AZURE_SPEECH_REGION, str) or not AZURE_SPEECH_REGION.strip():
         raise RuntimeError(f"AZURE_SPEECH_REGION is missing/invalid (type={type(AZURE_SPEECH_REGION)})")
 
-    text = _extract_audio_script(script_text)
-    if not text:
-        raise RuntimeError("No text found for audio generation (AUDIO SCRIPT is empty)")
-
     # SSML must be valid XML, and Azure has payload limits -> cap length
     safe_text = _sanitize_for_ssml(text)[:8000]
 
@@ -76,26 +85,109 @@ async def generate_audio_tts_and_upload(
     headers = {
         "Ocp-Apim-Subscription-Key": AZURE_SPEECH_KEY.strip(),
         "Content-Type": "application/ssml+xml",
-        "X-Microsoft-OutputFormat": "audio-16khz-128kbitrate-mono-mp3",
+        "X-Microsoft-OutputFormat": OUTPUT_FORMAT,
         "User-Agent": "genai-ed-backend",
     }
     # httpx requires all header values to be strings
     headers = {k: str(v) for k, v in headers.items() if v is not None}
 
-    async with httpx.AsyncClient(timeout=120) as client:
-        r = await client.post(tts_url, headers=headers, content=ssml.encode("utf-8"))
+    return tts_url, headers, ssml.encode("utf-8")
+
+
+def _truncate_at_word(text: str, max_chars: int) -> str:
+    if len(text) <= max_chars:
+        return text
+    cut = text.rfind(" ", 0, max_chars)
+    return text[: cut if cut > 0 else max_chars]
+
+
+async def open_audio_tts_stream(
+    script_text: str,
+    voice_name: str = DEFAULT_VOICE_NAME,
+    max_chars: int | None = None,
+) -> tuple[AsyncIterator[bytes], bool]:
+    """
+    Starts Azure TTS and returns an iterator over the MP3 bytes as Azure
+    sends them (nothing is buffered here), plus whether max_chars cut the text.
+
+    Azure errors are raised before the first chunk, so callers can still
+    answer with a proper error status instead of a broken stream.
+    """
+    text = _extract_audio_script(script_text)
+    if not text:
+        raise RuntimeError("No text found for audio generation (AUDIO SCRIPT is empty)")
+    truncated = bool(max_chars) and len(text) > max_chars
+    if truncated:
+        text = _truncate_at_word(text, max_chars)
+
+    tts_url, headers, body = _build_tts_request(text, voice_name)
+
+    client = httpx.AsyncClient(timeout=stage_timeout(120))
+    try:
+        request = client.build_request("POST", tts_url, headers=headers, content=body)
+        r = await client.send(request, stream=True)
+        r.raise_for_status()
+    except BaseException:
+        await client.aclose()
+        raise
+
+    async def chunks() -> AsyncIterator[bytes]:
+        try:
+            async for chunk in r.aiter_bytes(STREAM_CHUNK_BYTES):
+                yield chunk
+        finally:
+            await r.aclose()
+            await client.aclose()
+
+    return chunks(), truncated
+
+
+async def generate_audio_tts_and_upload(
+    lecture_id: str,
+    educator_id: str,
+    script_text: str,
+    voice_name: str = DEFAULT_VOICE_NAME,
+    input_hash: str | None = None,
+) -> tuple[str, str]:
+    """
+    Generates TTS audio using Azure Speech and uploads to Supabase Storage.
+    With input_hash (see audio_input_hash) the file goes to an immutable,
+    content-hashed path.
+
+    Returns:
+        (public_url, storage_path)
+    """
+    text = _extract_audio_script(script_text)
+    if not text:
+        raise RuntimeError("No text found for audio generation (AUDIO SCRIPT is empty)")
+
+    tts_url, headers, body = _build_tts_request(text, voice_name)
+
+    async with httpx.AsyncClient(timeout=stage_timeout(120)) as client:
+        r = await client.post(tts_url, headers=headers, content=body)
         r.raise_for_status()
         audio_bytes = r.content
 
-    storage_path = f"{educator_id}/{lecture_id}/artifacts/audio.mp3"
+    return upload_audio(lecture_id, educator_id, audio_bytes, input_hash)
+
+
+def upload_audio(
+    lecture_id: str,
+    educator_id: str,
+    audio_bytes: bytes,
+    input_hash: str | None = None,
+    name: str = "audio",
+) -> tuple[str, str]:
+    """
+    Returns:
+        (public_url, storage_path)
+    """
+    storage_path = artifact_storage_path(educator_id, lecture_id, name, "mp3", input_hash)
 
     supabase.storage.from_("lecture-assets").upload(
         storage_path,
         audio_bytes,
-        file_options={
-            "content-type": "audio/mpeg",
-            "x-upsert": "true",
-        },
+        file_options=upload_file_options("audio/mpeg", input_hash),
     )
 
     public_url = supabase.storage.from_("lecture-assets").get_public_url(storage_path)
@@ -1,11 +1,32 @@
+import asyncio
+import logging
+import tempfile
+from typing import AsyncIterator
+
 from supabase import create_client
 from core.config import SUPABASE_URL, SUPABASE_SERVICE_KEY
-from services.audio_generator import generate_audio_tts_and_upload
-from services.ppt_generator import generate_pptx_and_upload
-from services.video_generator import generate_video_avatar_and_upload
+from core.deadline import DeadlineExceeded, cancel_reason
+from core.events import job_events
+from services.audio_generator import (
+    generate_audio_tts_and_upload,
+    audio_input_hash,
+    open_audio_tts_stream,
+    upload_audio,
+)
+from services.ppt_generator import generate_pptx_and_upload, pptx_input_hash
+from services.video_generator import (
+    generate_video_avatar_and_upload,
+    video_avatar_input_hash,
+    manifest_segment_paths,
+)
 
 supabase = create_client(SUPABASE_URL, SUPABASE_SERVICE_KEY)
 
+logger = logging.getLogger(__name__)
+
+# Tee'd preview audio stays in memory up to this size, then spills to disk
+PREVIEW_SPOOL_BYTES = 2 * 1024 * 1024
+
 
 def _create_job(lecture_id: str, job_type: str):
     res = (
@@ -22,14 +43,71 @@ def _create_job(lecture_id: str, job_type: str):
         )
         .execute()
     )
-    return res.data[0]
+    job = res.data[0]
+    _publish_job(job)
+    return job
+
+
+def _publish_job(job: dict):
+    job_events.publish(
+        job["lecture_id"],
+        "job",
+        {
+            "job_id": job.get("id"),
+            "job_type": job.get("job_type"),
+            "status": job.get("status"),
+            "progress": job.get("progress"),
+            "result": job.get("result"),
+            "error_message": job.get("error_message"),
+        },
+    )
+
 
+def _update_job(job: dict, **fields):
+    """
+    Persists a job state transition and pushes it to stream subscribers.
+    """
+    supabase.table("lecture_jobs").update(fields).eq("id", job["id"]).execute()
+    job.update(fields)
+    _publish_job(job)
 
-def _update_job(job_id: str, **fields):
-    supabase.table("lecture_jobs").update(fields).eq("id", job_id).execute()
 
+def _progress_reporter(job: dict):
+    """
+    Progress ticks go to the event bus only (no DB write per tick).
+    """
+    def report(progress: int):
+        if job.get("progress") == progress:
+            return
+        job["progress"] = progress
+        job_events.publish(
+            job["lecture_id"],
+            "progress",
+            {"job_id": job["id"], "job_type": job.get("job_type"), "status": "running", "progress": progress},
+        )
+    return report
 
-def _upsert_artifact(lecture_id: str, artifact_type: str, file_url: str, storage_path: str | None = None):
+
+def get_job_snapshot(lecture_id: str) -> list[dict]:
+    """
+    Current lecture_jobs rows, sent once when a stream client connects fresh.
+    """
+    return (
+        supabase.table("lecture_jobs")
+        .select("id, job_type, status, progress, result, error_message")
+        .eq("lecture_id", lecture_id)
+        .execute()
+        .data
+    ) or []
+
+
+def _upsert_artifact(
+    lecture_id: str,
+    artifact_type: str,
+    file_url: str,
+    storage_path: str | None = None,
+    input_hash: str | None = None,
+):
     payload = {
         "lecture_id": lecture_id,
         "artifact_type": artifact_type,
@@ -38,11 +116,108 @@ def _upsert_artifact(lecture_id: str, artifact_type: str, file_url: str, storage
     }
     if storage_path is not None:
         payload["storage_path"] = storage_path
+    # Always written: a partial artifact must not keep a stale hash
+    payload["input_hash"] = input_hash
 
     supabase.table("lecture_artifacts").upsert(payload, on_conflict="lecture_id,artifact_type").execute()
 
 
-async def generate_content_for_lecture(lecture_id: str):
+def _delete_superseded(lecture_id: str, existing: dict | None, new_path: str | None):
+    """
+    Best-effort removal of the storage object(s) a regenerated artifact replaced.
+    Content-hashed paths change with every input change, so without this
+    storage grows with each script edit.
+    """
+    old_path = (existing or {}).get("storage_path")
+    if not old_path or old_path == new_path:
+        return
+    paths = [old_path]
+    if old_path.endswith(".json"):
+        # Segmented avatar video: the manifest plus every segment mp4
+        paths += manifest_segment_paths(old_path)
+    try:
+        supabase.storage.from_("lecture-assets").remove(paths)
+    except Exception as e:
+        logger.warning("Failed to delete superseded artifact(s) %s for lecture %s: %s", paths, lecture_id, e)
+
+
+def _replace_artifact(
+    lecture_id: str,
+    artifact_type: str,
+    file_url: str,
+    storage_path: str,
+    input_hash: str | None,
+    existing: dict | None,
+):
+    _upsert_artifact(lecture_id, artifact_type, file_url, storage_path, input_hash)
+    _delete_superseded(lecture_id, existing, storage_path)
+
+
+def _restore_artifact(lecture_id: str, artifact_type: str, previous: dict | None):
+    """
+    Puts back the artifact row a failed run had pointed at a partial result
+    (or removes the row if there was no previous artifact).
+    """
+    if previous and previous.get("file_url"):
+        _upsert_artifact(
+            lecture_id,
+            artifact_type,
+            previous["file_url"],
+            previous.get("storage_path"),
+            previous.get("input_hash"),
+        )
+    else:
+        (
+            supabase.table("lecture_artifacts")
+            .delete()
+            .eq("lecture_id", lecture_id)
+            .eq("artifact_type", artifact_type)
+            .execute()
+        )
+
+
+def _existing_artifacts(lecture_id: str) -> dict[str, dict]:
+    rows = (
+        supabase.table("lecture_artifacts")
+        .select("artifact_type, file_url, storage_path, input_hash")
+        .eq("lecture_id", lecture_id)
+        .execute()
+        .data
+    ) or []
+    return {r["artifact_type"]: r for r in rows}
+
+
+def _is_unchanged(existing: dict | None, input_hash: str) -> bool:
+    return bool(existing and existing.get("file_url") and existing.get("input_hash") == input_hash)
+
+
+def _latest_jobs(lecture_id: str) -> dict[str, dict]:
+    """
+    Most recent lecture_jobs row per job_type.
+    """
+    rows = (
+        supabase.table("lecture_jobs")
+        .select("id, lecture_id, job_type, status, progress, result, error_message, created_at")
+        .eq("lecture_id", lecture_id)
+        .order("created_at", desc=True)
+        .execute()
+        .data
+    ) or []
+    latest: dict[str, dict] = {}
+    for row in rows:
+        latest.setdefault(row["job_type"], row)
+    return latest
+
+
+async def generate_content_for_lecture(lecture_id: str, resume: bool = False):
+    """
+    Runs the audio / pptx / video_avatar jobs for the lecture's content_style.
+
+    resume=True continues a previous run instead of starting over: jobs whose
+    latest row succeeded with an up-to-date artifact are left untouched, and
+    only failed / interrupted / missing jobs are re-executed (reusing their
+    existing job rows and any finished Azure avatar synthesis).
+    """
     lecture = (
         supabase.table("lectures")
         .select("educator_id, content_style, script_text, avatar_character, avatar_style")
@@ -79,48 +254,120 @@ async def generate_content_for_lecture(lecture_id: str):
     if not jobs_to_run:
         raise RuntimeError("No content_style selected. Choose at least one of: audio, powerpoint, video.")
 
+    # Hash of everything that determines each artifact's bytes
+    input_hashes = {
+        "audio": audio_input_hash(script_text),
+        "pptx": pptx_input_hash(script_text),
+    }
+    if "video" in content_style:
+        input_hashes["video_avatar"] = video_avatar_input_hash(script_text, avatar_character, avatar_style)
+
+    existing_artifacts = _existing_artifacts(lecture_id)
+    prior_jobs = _latest_jobs(lecture_id) if resume else {}
+
     # Create jobs and keep full inserted rows (so we can return job IDs to frontend)
     created_jobs: dict[str, dict] = {}
-    for job_type, _artifact_type in jobs_to_run:
-        created_jobs[job_type] = _create_job(lecture_id, job_type)
+    resumed_jobs: dict[str, dict] = {}
+    kept_jobs: dict[str, dict] = {}
+    for job_type, artifact_type in jobs_to_run:
+        prior = prior_jobs.get(job_type)
+        if prior is None:
+            created_jobs[job_type] = _create_job(lecture_id, job_type)
+        elif prior.get("status") == "succeeded" and _is_unchanged(
+            existing_artifacts.get(artifact_type), input_hashes[artifact_type]
+        ):
+            kept_jobs[job_type] = prior
+        else:
+            _update_job(prior, status="queued", progress=0, result={}, error_message=None)
+            resumed_jobs[job_type] = prior
+
+    all_jobs = {**kept_jobs, **resumed_jobs, **created_jobs}
 
     # Run each job sequentially
-    for job_type, artifact_type in jobs_to_run:
-        job = created_jobs[job_type]
-        job_id = job["id"]
-
-        try:
-            _update_job(job_id, status="running", progress=10, result={}, error_message=None)
-
-            if job_type == "audio":
-                url, path = await generate_audio_tts_and_upload(lecture_id, educator_id, script_text)
-                _upsert_artifact(lecture_id, artifact_type, url, path)
-
-            elif job_type == "pptx":
-                url, path = await generate_pptx_and_upload(lecture_id, educator_id, script_text)
-                _upsert_artifact(lecture_id, artifact_type, url, path)
-
-            elif job_type == "video_avatar":
-                url, path = await generate_video_avatar_and_upload(
-                    lecture_id=lecture_id,
-                    educator_id=educator_id,
-                    script_text=script_text,
-                    avatar_character=avatar_character,
-                    avatar_style=avatar_style,
-                    job_id=job_id,  # so video generator can update progress while polling
+    try:
+        for job_type, artifact_type in jobs_to_run:
+            if job_type in kept_jobs:
+                continue
+
+            job = all_jobs[job_type]
+            input_hash = input_hashes[artifact_type]
+
+            # Same inputs as the last successful run -> skip synthesis + upload
+            existing = existing_artifacts.get(artifact_type)
+            if _is_unchanged(existing, input_hash):
+                _update_job(
+                    job,
+                    status="succeeded",
+                    progress=100,
+                    result={"skipped": True, "reason": "unchanged", "storage_path": existing.get("storage_path")},
+                    error_message=None,
                 )
-                _upsert_artifact(lecture_id, artifact_type, url, path)
+                continue
+
+            try:
+                _update_job(job, status="running", progress=10, result={}, error_message=None)
 
-            _update_job(job_id, status="succeeded", progress=100)
+                if job_type == "audio":
+                    url, path = await generate_audio_tts_and_upload(
+                        lecture_id, educator_id, script_text, input_hash=input_hash
+                    )
+                    _replace_artifact(lecture_id, artifact_type, url, path, input_hash, existing)
 
-        except Exception as e:
-            _update_job(
-                job_id,
-                status="failed",
-                progress=100,
-                result={"error": str(e)},
-                error_message=str(e),
-            )
+                elif job_type == "pptx":
+                    url, path = await generate_pptx_and_upload(
+                        lecture_id, educator_id, script_text, input_hash=input_hash
+                    )
+                    _replace_artifact(lecture_id, artifact_type, url, path, input_hash, existing)
+
+                elif job_type == "video_avatar":
+                    partial_published = False
+
+                    def publish_playlist(u: str, p: str):
+                        nonlocal partial_published
+                        partial_published = True
+                        _upsert_artifact(lecture_id, artifact_type, u, p)
+
+                    try:
+                        url, path = await generate_video_avatar_and_upload(
+                            lecture_id=lecture_id,
+                            educator_id=educator_id,
+                            script_text=script_text,
+                            avatar_character=avatar_character,
+                            avatar_style=avatar_style,
+                            on_progress=_progress_reporter(job),  # pushed to stream subscribers while polling
+                            input_hash=input_hash,
+                            # Segmented render: expose the manifest as soon as segment 0 is playable
+                            on_playlist_ready=publish_playlist,
+                        )
+                    except BaseException:
+                        # Don't leave the row on a half-rendered manifest (or count it as generated)
+                        if partial_published:
+                            _restore_artifact(lecture_id, artifact_type, existing)
+                        raise
+                    _replace_artifact(lecture_id, artifact_type, url, path, input_hash, existing)
+
+                _update_job(job, status="succeeded", progress=100)
+
+            except DeadlineExceeded:
+                # Request budget spent: stop the whole run, not just this job
+                raise
+            except Exception as e:
+                _update_job(
+                    job,
+                    status="failed",
+                    progress=100,
+                    result={"error": str(e)},
+                    error_message=str(e),
+                )
+    except (asyncio.CancelledError, DeadlineExceeded) as e:
+        # Deadline hit or client gone: don't leave jobs "running" forever.
+        # In-flight avatar syntheses are DELETEd by the video generator on the way out.
+        reason = str(e) if isinstance(e, DeadlineExceeded) else cancel_reason()
+        for job in all_jobs.values():
+            if job.get("status") in ("queued", "running"):
+                _update_job(job, status="failed", progress=100, result={"error": reason}, error_message=reason)
+        job_events.publish(lecture_id, "cancelled", {"reason": reason})
+        raise
 
     # Fetch artifacts to return + optionally mark lecture generated
     artifacts = (
@@ -135,10 +382,67 @@ async def generate_content_for_lecture(lecture_id: str):
     if has_any:
         supabase.table("lectures").update({"status": "generated"}).eq("id", lecture_id).execute()
 
+    job_events.publish(lecture_id, "complete", {"has_any_artifact": has_any})
+
     return {
         "lecture_id": lecture_id,
         "jobs_created": list(created_jobs.keys()),
-        "job_ids": {job_type: job_row.get("id") for job_type, job_row in created_jobs.items()},
+        "jobs_resumed": list(resumed_jobs.keys()),
+        "jobs_kept": list(kept_jobs.keys()),
+        "job_ids": {job_type: job_row.get("id") for job_type, job_row in all_jobs.items()},
         "has_any_artifact": has_any,
         "artifacts": artifacts,
     }
+
+
+async def open_audio_preview(lecture_id: str, save: bool = False, max_chars: int | None = None) -> AsyncIterator[bytes]:
+    """
+    Streams the lecture's AUDIO SCRIPT narration straight from Azure TTS.
+
+    With save=True the bytes are also tee'd to a temp file and uploaded once
+    the stream completes, becoming the "audio" artifact (same content-hashed
+    path as a content run, which will then skip it). A max_chars excerpt is
+    never stored: it is not the artifact, and nothing would reference it.
+    """
+    lecture = (
+        supabase.table("lectures")
+        .select("educator_id, script_text")
+        .eq("id", lecture_id)
+        .single()
+        .execute()
+        .data
+    )
+    if not lecture:
+        raise ValueError(f"Lecture not found: {lecture_id}")
+
+    script_text = lecture.get("script_text") or ""
+    if not script_text.strip():
+        raise RuntimeError("Lecture has no script_text. Generate script first.")
+
+    chunks, is_excerpt = await open_audio_tts_stream(script_text, max_chars=max_chars)
+    if not save or is_excerpt:
+        return chunks
+
+    educator_id = lecture["educator_id"]
+    input_hash = audio_input_hash(script_text)
+
+    async def tee() -> AsyncIterator[bytes]:
+        with tempfile.SpooledTemporaryFile(max_size=PREVIEW_SPOOL_BYTES) as spool:
+            async for chunk in chunks:
+                spool.write(chunk)
+                yield chunk
+
+            # Only reached when the whole stream was delivered
+            spool.seek(0)
+            audio_bytes = spool.read()
+            try:
+                url, path = await asyncio.to_thread(
+                    upload_audio, lecture_id, educator_id, audio_bytes, input_hash
+                )
+                existing = _existing_artifacts(lecture_id).get("audio")
+                _replace_artifact(lecture_id, "audio", url, path, input_hash, existing)
+            except Exception as e:
+                # Client already has its audio; storage is best-effort here
+                logger.warning("Failed to store audio preview for lecture %s: %s", lecture_id, e)
+
+    return tee()
@@ -0,0 +1,179 @@
+from __future__ import annotations
+
+from typing import List, Dict, Any, Optional, Tuple, BinaryIO
+import asyncio
+import codecs
+import mmap
+import re
+import tempfile
+
+import httpx
+from pypdf import PdfReader
+from docx import Document
+
+from core.deadline import stage_timeout, check_deadline
+from core.config import MATERIAL_MAX_BYTES, MATERIAL_SPOOL_MEMORY_BYTES
+
+# -----------------------------
+# File text extraction helpers
+# -----------------------------
+
+DOWNLOAD_CHUNK_BYTES = 64 * 1024
+
+
+class MaterialTooLargeError(RuntimeError):
+    pass
+
+
+class MaterialExtractionError(RuntimeError):
+    pass
+
+
+def _clean_text(s: str) -> str:
+    s = re.sub(r"\s+", " ", s).strip()
+    return s
+
+def _extract_text_from_pdf_file(f: BinaryIO) -> str:
+    reader = PdfReader(f)
+    if reader.is_encrypted and not reader.decrypt(""):
+        raise MaterialExtractionError("PDF is password-protected")
+    parts: List[str] = []
+    for page in reader.pages:
+        try:
+            parts.append(page.extract_text() or "")
+        except Exception:
+            continue
+    return _clean_text("\n".join(parts))
+
+def _extract_text_from_docx_file(f: BinaryIO) -> str:
+    doc = Document(f)
+    parts = [p.text for p in doc.paragraphs if p.text]
+    return _clean_text("\n".join(parts))
+
+def _extract_text_from_txt_file(f: BinaryIO) -> str:
+    try:
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="ignore")
+        parts: List[str] = []
+        while True:
+            block = f.read(DOWNLOAD_CHUNK_BYTES)
+            if not block:
+                break
+            parts.append(decoder.decode(block))
+        parts.append(decoder.decode(b"", final=True))
+        return _clean_text("".join(parts))
+    except Exception:
+        return ""
+
+def _guess_ext_from_url(url: str, mime: Optional[str]) -> str:
+    if mime:
+        if "pdf" in mime:
+            return "pdf"
+        if "word" in mime or "docx" in mime:
+            return "docx"
+        if "text" in mime:
+            return "txt"
+    lower = url.lower()
+    if lower.endswith(".pdf"):
+        return "pdf"
+    if lower.endswith(".docx"):
+        return "docx"
+    if lower.endswith(".txt"):
+        return "txt"
+    return ""
+
+
+async def _download_to_spool(
+    client: httpx.AsyncClient,
+    url: str,
+    max_bytes: int,
+) -> Tuple[tempfile.SpooledTemporaryFile, int]:
+    """
+    Streams url into a SpooledTemporaryFile (memory up to
+    MATERIAL_SPOOL_MEMORY_BYTES, then disk), enforcing max_bytes both on the
+    declared Content-Length and on the bytes actually received.
+
+    Returns: (file positioned at 0, size in bytes)
+    """
+    spool = tempfile.SpooledTemporaryFile(max_size=MATERIAL_SPOOL_MEMORY_BYTES)
+    try:
+        async with client.stream("GET", url) as r:
+            r.raise_for_status()
+
+            declared = r.headers.get("content-length")
+            if declared and declared.isdigit() and int(declared) > max_bytes:
+                raise MaterialTooLargeError(
+                    f"Material is {int(declared)} bytes, limit is {max_bytes}"
+                )
+
+            size = 0
+            async for block in r.aiter_bytes(DOWNLOAD_CHUNK_BYTES):
+                check_deadline()
+                size += len(block)
+                if size > max_bytes:
+                    raise MaterialTooLargeError(f"Material exceeds limit of {max_bytes} bytes")
+                spool.write(block)
+    except BaseException:
+        spool.close()
+        raise
+
+    spool.seek(0)
+    return spool, size
+
+
+def _extract_from_spool(ext: str, spool: tempfile.SpooledTemporaryFile, size: int) -> str:
+    if ext == "pdf":
+        if size > MATERIAL_SPOOL_MEMORY_BYTES and size > 0:
+            # Already spilled to disk: let pypdf read through a read-only
+            # mapping instead of pulling the whole file onto the heap.
+            with mmap.mmap(spool.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                return _extract_text_from_pdf_file(mapped)
+        return _extract_text_from_pdf_file(spool)
+    if ext == "docx":
+        return _extract_text_from_docx_file(spool)
+    if ext == "txt":
+        return _extract_text_from_txt_file(spool)
+    return ""
+
+
+async def download_and_extract(
+    material: Dict[str, Any],
+    timeout_s: int = 30,
+    max_bytes: int = MATERIAL_MAX_BYTES,
+    raise_parse_errors: bool = False,
+) -> Tuple[str, str]:
+    """
+    Returns: (label, extracted_text)
+    label is something like "main: HW1.pdf"
+
+    Raises MaterialTooLargeError when the file is over max_bytes. Parse
+    failures (corrupt / encrypted files) return "" unless raise_parse_errors,
+    in which case they raise MaterialExtractionError.
+    """
+    url = material.get("material_url")
+    name = material.get("material_name") or "unknown"
+    mtype = material.get("material_type") or "main"
+    mime = material.get("file_mime")
+
+    label = f"{mtype}: {name}"
+
+    if not url:
+        return (label, "")
+
+    ext = _guess_ext_from_url(url, mime)
+
+    # Only try text extraction for supported types
+    if ext not in {"pdf", "docx", "txt"}:
+        return (label, "")
+
+    async with httpx.AsyncClient(follow_redirects=True, timeout=stage_timeout(timeout_s)) as client:
+        spool, size = await _download_to_spool(client, url, max_bytes)
+
+    with spool:
+        try:
+            # PDF/DOCX parsing is CPU-bound: keep it off the event loop
+            text = await asyncio.to_thread(_extract_from_spool, ext, spool, size)
+            return (label, text)
+        except Exception as e:
+            if raise_parse_errors:
+                raise MaterialExtractionError(f"Could not extract text from {name}: {e}") from e
+            return (label, "")
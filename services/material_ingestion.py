@@ -0,0 +1,200 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from datetime import datetime, timezone
+from typing import List, Dict, Any, Optional, Tuple
+
+from supabase import create_client
+from core.config import SUPABASE_URL, SUPABASE_SERVICE_KEY
+from core.deadline import current_deadline
+from services.material_extractor import download_and_extract
+
+supabase = create_client(SUPABASE_URL, SUPABASE_SERVICE_KEY)
+
+# lecture_materials.extraction_status values
+STATUS_PENDING = "pending"
+STATUS_PROCESSING = "processing"
+STATUS_SUCCEEDED = "succeeded"
+STATUS_FAILED = "failed"
+
+CHUNK_CHARS = 2000
+CHUNK_OVERLAP = 200
+
+# How long script generation waits (in total) for in-flight ingestions
+# before extracting inline itself
+INGEST_WAIT_S = 60
+INGEST_POLL_S = 1.0
+# A "processing" row older than this is considered abandoned
+INGEST_STALE_S = 600
+
+MATERIAL_COLUMNS = (
+    "id, material_name, material_type, material_url, file_mime, "
+    "extraction_status, extraction_started_at, extracted_text"
+)
+
+
+def _chunk_text(text: str, max_chars: int = CHUNK_CHARS, overlap: int = CHUNK_OVERLAP) -> List[str]:
+    """
+    Splits on whitespace into ~max_chars chunks with a small overlap,
+    so later retrieval/prompting can pick pieces without re-extracting.
+    """
+    if not text:
+        return []
+
+    chunks: List[str] = []
+    start = 0
+    n = len(text)
+    while start < n:
+        end = min(n, start + max_chars)
+        if end < n:
+            cut = text.rfind(" ", start + max_chars // 2, end)
+            if cut != -1:
+                end = cut
+        chunks.append(text[start:end].strip())
+        if end >= n:
+            break
+        start = max(end - overlap, start + 1)
+    return [c for c in chunks if c]
+
+
+def _update_material(material_id: str, **fields):
+    supabase.table("lecture_materials").update(fields).eq("id", material_id).execute()
+
+
+def cached_extraction(material: Dict[str, Any]) -> Optional[Tuple[str, str]]:
+    """
+    (label, text) from a completed ingestion, or None if the material still
+    needs inline extraction.
+    """
+    if material.get("extraction_status") != STATUS_SUCCEEDED:
+        return None
+    name = material.get("material_name") or "unknown"
+    mtype = material.get("material_type") or "main"
+    return (f"{mtype}: {name}", material.get("extracted_text") or "")
+
+
+def _parse_ts(value: Any) -> Optional[datetime]:
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        return None
+
+
+def is_in_flight(material: Dict[str, Any]) -> bool:
+    """
+    True only for a "processing" row started recently; older ones are
+    treated as abandoned (worker died mid-ingest) and can be redone.
+    """
+    if material.get("extraction_status") != STATUS_PROCESSING:
+        return False
+    started = _parse_ts(material.get("extraction_started_at"))
+    if started is None:
+        return False
+    return (datetime.now(timezone.utc) - started).total_seconds() < INGEST_STALE_S
+
+
+async def wait_for_ingestions(materials: List[Dict[str, Any]], timeout_s: float = INGEST_WAIT_S) -> List[Dict[str, Any]]:
+    """
+    Waits for every in-flight ingestion among `materials` together (one
+    shared timeout, capped by the request deadline) so the caller can reuse
+    the results instead of repeating the download + parse.
+
+    Returns: materials, with finished rows replaced by their latest version
+    """
+    pending = {m["id"] for m in materials if m.get("id") and is_in_flight(m)}
+    if not pending:
+        return materials
+
+    deadline = current_deadline()
+    if deadline is not None:
+        timeout_s = min(timeout_s, max(0.0, deadline.remaining() - 5))
+    give_up_at = time.monotonic() + timeout_s
+
+    latest: Dict[str, Dict[str, Any]] = {}
+    while pending and time.monotonic() < give_up_at:
+        await asyncio.sleep(INGEST_POLL_S)
+        rows = (
+            supabase.table("lecture_materials")
+            .select(MATERIAL_COLUMNS)
+            .in_("id", list(pending))
+            .execute()
+            .data
+        ) or []
+        for row in rows:
+            if not is_in_flight(row):
+                latest[row["id"]] = row
+                pending.discard(row["id"])
+
+    return [latest.get(m.get("id"), m) for m in materials]
+
+
+async def ingest_material(material_id: str) -> str:
+    """
+    Downloads, extracts, chunks and caches one lecture_materials row.
+    Meant to run in the background right after upload.
+
+    Returns: final extraction_status
+    """
+    material = (
+        supabase.table("lecture_materials")
+        .select("id, material_name, material_type, material_url, file_mime")
+        .eq("id", material_id)
+        .single()
+        .execute()
+        .data
+    )
+    if not material:
+        raise ValueError(f"Material not found: {material_id}")
+
+    _update_material(
+        material_id,
+        extraction_status=STATUS_PROCESSING,
+        extraction_error=None,
+        extraction_started_at=datetime.now(timezone.utc).isoformat(),
+    )
+
+    try:
+        _label, text = await download_and_extract(material, raise_parse_errors=True)
+    except Exception as e:
+        _update_material(material_id, extraction_status=STATUS_FAILED, extraction_error=str(e))
+        return STATUS_FAILED
+    except BaseException:
+        # Cancelled (shutdown / restart): don't leave the row stuck in "processing"
+        _update_material(material_id, extraction_status=STATUS_PENDING, extraction_error="Ingestion interrupted")
+        raise
+
+    _update_material(
+        material_id,
+        extraction_status=STATUS_SUCCEEDED,
+        extraction_error=None,
+        extracted_text=text,
+        extracted_chunks=_chunk_text(text),
+        extracted_at=datetime.now(timezone.utc).isoformat(),
+    )
+    return STATUS_SUCCEEDED
+
+
+async def ingest_lecture_materials(lecture_id: str) -> List[str]:
+    """
+    Ingests every material of a lecture that is not already extracted.
+
+    Returns: ids of the materials that were processed
+    """
+    materials = (
+        supabase.table("lecture_materials")
+        .select("id, extraction_status, extraction_started_at")
+        .eq("lecture_id", lecture_id)
+        .execute()
+        .data
+    ) or []
+
+    processed: List[str] = []
+    for m in materials:
+        if m.get("extraction_status") == STATUS_SUCCEEDED or is_in_flight(m):
+            continue
+        await ingest_material(m["id"])
+        processed.append(m["id"])
+    return processed
@@ -2,9 +2,15 @@ from io import BytesIO
 from pptx import Presentation
 from supabase import create_client
 from core.config import SUPABASE_URL, SUPABASE_SERVICE_KEY
+from services.artifact_hash import compute_input_hash, artifact_storage_path, upload_file_options
 
 supabase = create_client(SUPABASE_URL, SUPABASE_SERVICE_KEY)
 
+PPTX_CONTENT_TYPE = "application/vnd.openxmlformats-officedocument.presentationml.presentation"
+
+# Bump when slide parsing / layout changes (invalidates input hashes)
+PPTX_GENERATOR_VERSION = "1"
+
 
 def _extract_ppt_script(script_text: str) -> str:
     marker = "PPT SCRIPT:"
@@ -13,6 +19,10 @@ def _extract_ppt_script(script_text: str) -> str:
     return script_text.strip()
 
 
+def pptx_input_hash(script_text: str) -> str:
+    return compute_input_hash("pptx", PPTX_GENERATOR_VERSION, text=_extract_ppt_script(script_text))
+
+
 def _build_simple_ppt(ppt_script: str) -> bytes:
     prs = Presentation()
 
@@ -40,8 +50,16 @@ def _build_simple_ppt(ppt_script: str) -> bytes:
     return bio.getvalue()
 
 
-async def generate_pptx_and_upload(lecture_id: str, educator_id: str, script_text: str) -> tuple[str, str]:
+async def generate_pptx_and_upload(
+    lecture_id: str,
+    educator_id: str,
+    script_text: str,
+    input_hash: str | None = None,
+) -> tuple[str, str]:
     """
+    With input_hash (see pptx_input_hash) the file goes to an immutable,
+    content-hashed path.
+
     Returns:
         (public_url, storage_path)
     """
@@ -51,15 +69,12 @@ async def generate_pptx_and_upload(lecture_id: str, educator_id: str, script_tex
 
     pptx_bytes = _build_simple_ppt(ppt_script)
 
-    storage_path = f"{educator_id}/{lecture_id}/artifacts/lecture.pptx"
+    storage_path = artifact_storage_path(educator_id, lecture_id, "lecture", "pptx", input_hash)
 
     supabase.storage.from_("lecture-assets").upload(
         storage_path,
         pptx_bytes,
-        file_options={
-            "content-type": "application/vnd.openxmlformats-officedocument.presentationml.presentation",
-            "x-upsert": "true",
-        },
+        file_options=upload_file_options(PPTX_CONTENT_TYPE, input_hash),
     )
 
     public_url = supabase.storage.from_("lecture-assets").get_public_url(storage_path)
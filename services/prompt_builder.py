@@ -51,3 +51,107 @@ MATERIAL CONTENT (MAIN):
 MATERIAL CONTENT (BACKGROUND):
 {background_material_text or "[No extractable background text found]"}
 """.strip()
+
+
+# Section header used in script_text for each selected mode (order matters:
+# audio/ppt extractors split on these markers).
+SECTION_HEADERS = {
+    "video": "VIDEO SCRIPT:",
+    "audio": "AUDIO SCRIPT:",
+    "powerpoint": "PPT SCRIPT:",
+}
+
+SECTION_INSTRUCTIONS = {
+    "video": "A spoken script for an on-camera avatar presenter. Natural, conversational narration only (no stage directions).",
+    "audio": "A narration script for an audio-only lecture. Spoken prose only; describe anything visual in words.",
+    "powerpoint": "Slide content as bullet points. Use the format '- Slide N: <title>' followed by 3-6 short bullets per slide.",
+}
+
+
+def build_outline_prompt(
+    lecture_title: str,
+    ai_prompt: str,
+    video_length: int,
+    main_materials: List[str],
+    background_materials: List[str],
+    main_material_text: str,
+    background_material_text: str
+) -> str:
+    return f"""
+You are an expert educator and instructional designer.
+
+TASK:
+Plan a lecture grounded ONLY in the provided course materials content below.
+Do NOT write the full script yet. Produce a shared outline that several writers
+will expand into a video script, an audio script and slides.
+
+Lecture Title: {lecture_title}
+Desired Duration: {video_length} minutes
+Educator Prompt / Instruction: {ai_prompt or "Create an engaging educational script based on the materials."}
+
+OUTPUT RULES:
+- Format MUST match exactly:
+TITLE:
+<final lecture title>
+
+OUTLINE:
+<numbered list of sections; under each, 2-4 short bullets with the key points and facts to cover>
+
+CONSTRAINTS:
+- Use the materials content below as the source of truth.
+- Size the outline so it can be taught in about {video_length} minutes.
+
+MATERIAL NAMES:
+Main Materials: {", ".join(main_materials) or "None"}
+Background Materials: {", ".join(background_materials) or "None"}
+
+MATERIAL CONTENT (MAIN):
+{main_material_text or "[No extractable main text found]"}
+
+MATERIAL CONTENT (BACKGROUND):
+{background_material_text or "[No extractable background text found]"}
+""".strip()
+
+
+def build_section_prompt(
+    mode: str,
+    lecture_title: str,
+    ai_prompt: str,
+    video_length: int,
+    outline: str,
+    main_material_text: str,
+    background_material_text: str
+) -> str:
+    header = SECTION_HEADERS[mode]
+
+    return f"""
+You are an expert educator and instructional designer.
+
+TASK:
+Write ONLY the "{header}" section of a lecture, following the shared outline below.
+Other writers are producing the other sections from the same outline, so stay on it.
+
+Lecture Title: {lecture_title}
+Desired Duration: {video_length} minutes
+Educator Prompt / Instruction: {ai_prompt or "Create an engaging educational script based on the materials."}
+
+SECTION:
+{SECTION_INSTRUCTIONS[mode]}
+
+OUTPUT RULES:
+- Output ONLY the section body. Do NOT repeat the "{header}" header or add other sections.
+
+CONSTRAINTS:
+- Use the outline and the materials content below as the source of truth.
+- If the materials are insufficient for a detail, say so briefly and move on.
+- Be concise and structured. Make it teachable.
+
+SHARED OUTLINE:
+{outline}
+
+MATERIAL CONTENT (MAIN):
+{main_material_text or "[No extractable main text found]"}
+
+MATERIAL CONTENT (BACKGROUND):
+{background_material_text or "[No extractable background text found]"}
+""".strip()
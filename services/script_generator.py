@@ -1,115 +1,179 @@
 from __future__ import annotations
 
-from typing import List, Dict, Any, Optional, Tuple
+from typing import List, Dict, Any, Tuple
+import asyncio
+import logging
 import re
-import io
-
-import httpx
-from pypdf import PdfReader
-from docx import Document
 
 from supabase import create_client
-from core.config import SUPABASE_URL, SUPABASE_SERVICE_KEY
-from core.azure_openai import call_azure_openai
-from services.prompt_builder import build_script_prompt
+from core.config import SUPABASE_URL, SUPABASE_SERVICE_KEY, SCRIPT_GENERATION_MODE
+from core.azure_openai import call_azure_openai_with_usage
+from core.tokens import (
+    max_tokens_for_script,
+    max_tokens_for_section,
+    max_tokens_for_outline,
+    required_tokens_for_script,
+    required_tokens_for_section,
+    exceeds_output_cap,
+)
+from services.material_extractor import download_and_extract, MaterialTooLargeError
+from services.material_ingestion import cached_extraction, wait_for_ingestions, MATERIAL_COLUMNS
+from services.prompt_builder import (
+    build_script_prompt,
+    build_outline_prompt,
+    build_section_prompt,
+    SECTION_HEADERS,
+)
 
 supabase = create_client(SUPABASE_URL, SUPABASE_SERVICE_KEY)
 
-# -----------------------------
-# File text extraction helpers
-# -----------------------------
-
-def _clean_text(s: str) -> str:
-    s = re.sub(r"\s+", " ", s).strip()
-    return s
-
-def _extract_text_from_pdf_bytes(data: bytes) -> str:
-    reader = PdfReader(io.BytesIO(data))
-    parts: List[str] = []
-    for page in reader.pages:
-        try:
-            parts.append(page.extract_text() or "")
-        except Exception:
-            continue
-    return _clean_text("\n".join(parts))
+logger = logging.getLogger(__name__)
 
-def _extract_text_from_docx_bytes(data: bytes) -> str:
-    doc = Document(io.BytesIO(data))
-    parts = [p.text for p in doc.paragraphs if p.text]
-    return _clean_text("\n".join(parts))
 
-def _extract_text_from_txt_bytes(data: bytes) -> str:
-    try:
-        return _clean_text(data.decode("utf-8", errors="ignore"))
-    except Exception:
-        return ""
+# -----------------------------
+# Prompt material helpers
+# -----------------------------
 
-def _guess_ext_from_url(url: str, mime: Optional[str]) -> str:
-    if mime:
-        if "pdf" in mime:
-            return "pdf"
-        if "word" in mime or "docx" in mime:
-            return "docx"
-        if "text" in mime:
-            return "txt"
-    lower = url.lower()
-    if lower.endswith(".pdf"):
-        return "pdf"
-    if lower.endswith(".docx"):
-        return "docx"
-    if lower.endswith(".txt"):
-        return "txt"
-    return ""
-
-
-async def _download_and_extract(material: Dict[str, Any], timeout_s: int = 30) -> Tuple[str, str]:
+def _truncate_for_prompt(text: str, max_chars: int = 18000) -> str:
     """
-    Returns: (label, extracted_text)
-    label is something like "main: HW1.pdf"
+    Keeps prompt size sane. Adjust if needed.
     """
-    url = material.get("material_url")
-    name = material.get("material_name") or "unknown"
-    mtype = material.get("material_type") or "main"
-    mime = material.get("file_mime")
+    if not text:
+        return ""
+    if len(text) <= max_chars:
+        return text
+    return text[:max_chars] + "\n\n[TRUNCATED]"
 
-    label = f"{mtype}: {name}"
 
-    if not url:
-        return (label, "")
+# -----------------------------
+# Parallel (per-section) generation
+# -----------------------------
 
-    ext = _guess_ext_from_url(url, mime)
+# "TITLE:", "**TITLE:** Foo", "## Outline:" ... -> "TITLE:\n" / "OUTLINE:\n"
+_MARKER_RE = re.compile(r"^[ \t#*_]*(TITLE|OUTLINE)[ \t*_]*(?::|$)[ \t*_]*", re.MULTILINE | re.IGNORECASE)
 
-    # Only try text extraction for supported types
-    if ext not in {"pdf", "docx", "txt"}:
-        return (label, "")
 
-    async with httpx.AsyncClient(follow_redirects=True, timeout=timeout_s) as client:
-        r = await client.get(url)
-        r.raise_for_status()
-        data = r.content
+def _parse_outline(outline_text: str, fallback_title: str) -> Tuple[str, str]:
+    """
+    Returns: (title, outline)
+    Tolerates the model skipping the TITLE:/OUTLINE: markers.
+    """
+    text = _MARKER_RE.sub(lambda m: f"{m.group(1).upper()}:\n", (outline_text or "").strip())
+    title = fallback_title
+    outline = text
+
+    if "TITLE:" in text:
+        after = text.split("TITLE:", 1)[1]
+        head, _, rest = after.partition("OUTLINE:")
+        first_line = head.strip().split("\n", 1)[0].strip(" \t*#_")
+        if first_line:
+            title = first_line
+        outline = rest.strip() if rest.strip() else head.strip()
+    elif "OUTLINE:" in text:
+        outline = text.split("OUTLINE:", 1)[1].strip()
+
+    return title, outline
+
+
+def _strip_section_header(mode: str, text: str) -> str:
+    body = (text or "").strip()
+    header = SECTION_HEADERS[mode]
+    if body.upper().startswith(header):
+        body = body[len(header):].strip()
+    return body
+
+
+async def _generate_script_parallel(
+    title: str,
+    ai_prompt: str,
+    video_length: int,
+    main_names: List[str],
+    bg_names: List[str],
+    selected_modes: List[str],
+    main_text: str,
+    background_text: str,
+) -> Tuple[str, List[Dict[str, Any]]]:
+    """
+    Outline first, then VIDEO/AUDIO/PPT as concurrent completions.
+    Output uses the same format as the single-call prompt so the
+    downstream extractors keep working.
 
+    Returns: (script_text, usage records per call)
+    """
+    outline_prompt = build_outline_prompt(
+        lecture_title=title,
+        ai_prompt=ai_prompt,
+        video_length=video_length,
+        main_materials=main_names,
+        background_materials=bg_names,
+        main_material_text=main_text,
+        background_material_text=background_text,
+    )
+    outline_text, outline_usage = await call_azure_openai_with_usage(
+        outline_prompt, max_tokens=max_tokens_for_outline(video_length)
+    )
+    usages = [{"stage": "outline", **outline_usage}]
+    final_title, outline = _parse_outline(outline_text, title)
+
+    # Keep the canonical section order regardless of content_style order
+    modes = [m for m in SECTION_HEADERS if m in selected_modes]
+
+    for mode in modes:
+        required = required_tokens_for_section(mode, video_length)
+        if exceeds_output_cap(required):
+            logger.warning(
+                "%s section of a %s-minute lecture needs ~%s output tokens, above the deployment cap; "
+                "it will likely be truncated",
+                mode, video_length, required,
+            )
+
+    tasks = [
+        asyncio.ensure_future(call_azure_openai_with_usage(
+            build_section_prompt(
+                mode=mode,
+                lecture_title=final_title,
+                ai_prompt=ai_prompt,
+                video_length=video_length,
+                outline=outline,
+                main_material_text=main_text,
+                background_material_text=background_text,
+            ),
+            max_tokens=max_tokens_for_section(mode, video_length),
+        ))
+        for mode in modes
+    ]
     try:
-        if ext == "pdf":
-            return (label, _extract_text_from_pdf_bytes(data))
-        if ext == "docx":
-            return (label, _extract_text_from_docx_bytes(data))
-        if ext == "txt":
-            return (label, _extract_text_from_txt_bytes(data))
-    except Exception:
-        return (label, "")
+        results = await asyncio.gather(*tasks)
+    except BaseException:
+        # One section failed: don't keep paying for the others
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
 
-    return (label, "")
+    parts = [f"TITLE:\n{final_title}"]
+    for mode, (body, usage) in zip(modes, results):
+        parts.append(f"{SECTION_HEADERS[mode]}\n{_strip_section_header(mode, body)}")
+        usages.append({"stage": f"section:{mode}", **usage})
+    return "\n\n".join(parts), usages
 
 
-def _truncate_for_prompt(text: str, max_chars: int = 18000) -> str:
+# -----------------------------
+# Usage accounting
+# -----------------------------
+
+def _record_llm_usage(lecture_id: str, usages: List[Dict[str, Any]]) -> None:
     """
-    Keeps prompt size sane. Adjust if needed.
+    Stores one lecture_llm_usage row per completion (capacity planning).
+    Best-effort: accounting must never fail script generation.
     """
-    if not text:
-        return ""
-    if len(text) <= max_chars:
-        return text
-    return text[:max_chars] + "\n\n[TRUNCATED]"
+    if not usages:
+        return
+    rows = [{"lecture_id": lecture_id, **u} for u in usages]
+    try:
+        supabase.table("lecture_llm_usage").insert(rows).execute()
+    except Exception as e:
+        logger.warning("Failed to record LLM usage for lecture %s: %s", lecture_id, e)
 
 
 # -----------------------------
@@ -152,7 +216,7 @@ async def generate_script(lecture_id: str) -> str:
     materials = (
         supabase
         .table("lecture_materials")
-        .select("material_name, material_type, material_url, file_mime")
+        .select(MATERIAL_COLUMNS)
         .eq("lecture_id", lecture_id)
         .execute()
         .data
@@ -173,10 +237,18 @@ async def generate_script(lecture_id: str) -> str:
         else:
             bg_names.append(mname)
 
-    # Extract in sequence (simple + reliable).
-    # If you want faster, we can parallelize with asyncio.gather later.
+    # Ingestion already running for some files: wait for them (together)
+    # rather than redo the work
+    materials = await wait_for_ingestions(materials)
+
+    # Materials pre-extracted on upload (material_ingestion) are used as-is;
+    # anything not ingested yet is extracted inline, in sequence.
     for m in materials:
-        label, text = await _download_and_extract(m)
+        try:
+            label, text = cached_extraction(m) or await download_and_extract(m)
+        except MaterialTooLargeError as e:
+            logger.warning("Skipping material %s: %s", m.get("material_name"), e)
+            continue
         if not text:
             continue
         if (m.get("material_type") or "main").lower() == "main":
@@ -187,20 +259,48 @@ async def generate_script(lecture_id: str) -> str:
     main_text = _truncate_for_prompt("\n\n".join(extracted_main))
     background_text = _truncate_for_prompt("\n\n".join(extracted_bg))
 
-    # 4) Build a prompt that includes extracted text + selected modes
-    prompt = build_script_prompt(
-        lecture_title=title,
-        ai_prompt=ai_prompt,
-        video_length=video_length,
-        main_materials=main_names,
-        background_materials=bg_names,
-        selected_modes=selected_modes,          # <-- NEW
-        main_material_text=main_text,           # <-- NEW
-        background_material_text=background_text # <-- NEW
-    )
-
-    # 5) Generate via Azure OpenAI
-    script_text = await call_azure_openai(prompt)
+    # 4) + 5) Generate via Azure OpenAI
+    use_parallel = SCRIPT_GENERATION_MODE == "parallel"
+    required = required_tokens_for_script(video_length, selected_modes)
+    if not use_parallel and exceeds_output_cap(required):
+        # One completion can't hold every section: give each its own budget instead
+        logger.warning(
+            "Script for lecture %s needs ~%s output tokens, above the deployment cap; "
+            "switching to per-section generation",
+            lecture_id, required,
+        )
+        use_parallel = True
+
+    if use_parallel:
+        # Wall-clock = outline + slowest section instead of all sections back to back
+        script_text, usages = await _generate_script_parallel(
+            title=title,
+            ai_prompt=ai_prompt,
+            video_length=video_length,
+            main_names=main_names,
+            bg_names=bg_names,
+            selected_modes=selected_modes,
+            main_text=main_text,
+            background_text=background_text,
+        )
+    else:
+        # Build a prompt that includes extracted text + selected modes
+        prompt = build_script_prompt(
+            lecture_title=title,
+            ai_prompt=ai_prompt,
+            video_length=video_length,
+            main_materials=main_names,
+            background_materials=bg_names,
+            selected_modes=selected_modes,          # <-- NEW
+            main_material_text=main_text,           # <-- NEW
+            background_material_text=background_text # <-- NEW
+        )
+        script_text, usage = await call_azure_openai_with_usage(
+            prompt, max_tokens=max_tokens_for_script(video_length, selected_modes)
+        )
+        usages = [{"stage": "script", **usage}]
+
+    _record_llm_usage(lecture_id, usages)
 
     # 6) Save results back to Supabase
     supabase.table("lectures").update({
@@ -1,5 +1,8 @@
 import asyncio
+import json
+import logging
 import re
+from typing import Callable
 from xml.sax.saxutils import escape
 
 import httpx
@@ -10,16 +13,31 @@ from core.config import (
     SUPABASE_SERVICE_KEY,
     AZURE_SPEECH_KEY,
     AZURE_SPEECH_REGION,
+    AVATAR_SEGMENT_MAX_CHARS,
+    AVATAR_MAX_CONCURRENCY,
 )
+from core.deadline import stage_timeout
+from services.artifact_hash import compute_input_hash, artifact_storage_path, upload_file_options
 
 supabase = create_client(SUPABASE_URL, SUPABASE_SERVICE_KEY)
 
+logger = logging.getLogger(__name__)
+
 _TAG_RE = re.compile(r"<[^>]+>")
+_PARAGRAPH_RE = re.compile(r"\n\s*\n")
+_SENTENCE_RE = re.compile(r"(?<=[.!?])\s+")
 API_VERSION = "2024-08-01"
 
 # Avatar endpoint is much more reliable with Jenny than Ava
 AVATAR_VOICE_NAME = "en-US-JennyMultilingualNeural"
 
+# Bump when SSML / avatarConfig / segmenting changes (invalidates input hashes)
+VIDEO_GENERATOR_VERSION = "2"
+
+MANIFEST_VERSION = 1
+AVATAR_REQUEST_TIMEOUT_S = 180
+AVATAR_CLEANUP_TIMEOUT_S = 10
+
 
 def _sanitize_for_ssml(text: str) -> str:
     if not isinstance(text, str):
@@ -36,6 +54,65 @@ def _extract_video_script(script_text: str) -> str:
     return (script_text or "").strip()
 
 
+def video_avatar_input_hash(script_text: str, avatar_character: str, avatar_style: str) -> str:
+    return compute_input_hash(
+        "video_avatar",
+        VIDEO_GENERATOR_VERSION,
+        text=_extract_video_script(script_text),
+        voice_name=AVATAR_VOICE_NAME,
+        avatar_character=avatar_character,
+        avatar_style=avatar_style,
+        segment_max_chars=AVATAR_SEGMENT_MAX_CHARS,
+    )
+
+
+def _split_long_piece(piece: str, max_chars: int) -> list[str]:
+    """
+    Sentence boundaries first; a single over-long sentence is cut at whitespace.
+    """
+    out: list[str] = []
+    for sentence in _SENTENCE_RE.split(piece):
+        sentence = sentence.strip()
+        while len(_sanitize_for_ssml(sentence)) > max_chars:
+            cut = sentence.rfind(" ", 0, max_chars // 2)
+            if cut <= 0:
+                cut = max_chars // 2
+            out.append(sentence[:cut].strip())
+            sentence = sentence[cut:].strip()
+        if sentence:
+            out.append(sentence)
+    return out
+
+
+def _split_into_segments(text: str, max_chars: int = AVATAR_SEGMENT_MAX_CHARS) -> list[str]:
+    """
+    Packs paragraphs (or sentences of over-long paragraphs) into segments
+    whose sanitized SSML text stays within max_chars.
+    """
+    pieces: list[str] = []
+    for paragraph in _PARAGRAPH_RE.split(text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if len(_sanitize_for_ssml(paragraph)) <= max_chars:
+            pieces.append(paragraph)
+        else:
+            pieces.extend(_split_long_piece(paragraph, max_chars))
+
+    segments: list[str] = []
+    current = ""
+    for piece in pieces:
+        candidate = f"{current}\n\n{piece}" if current else piece
+        if current and len(_sanitize_for_ssml(candidate)) > max_chars:
+            segments.append(current)
+            current = piece
+        else:
+            current = candidate
+    if current:
+        segments.append(current)
+    return segments
+
+
 def _to_ssml(text: str) -> str:
     safe_text = _sanitize_for_ssml(text)[:8000]
     return f"""<speak version="1.0" xml:lang="en-US">
@@ -45,43 +122,43 @@ def _to_ssml(text: str) -> str:
 </speak>"""
 
 
-async def generate_video_avatar_and_upload(
-    lecture_id: str,
-    educator_id: str,
-    script_text: str,
+def _synthesis_id(lecture_id: str, input_hash: str | None, index: int | None) -> str:
+    # Must be 3-64 chars, letters/numbers/-/_, start+end with alnum
+    synthesis_id = f"{lecture_id}-avatar"
+    if input_hash:
+        synthesis_id += f"-{input_hash[:8]}"
+    if index is not None:
+        synthesis_id += f"-{index}"
+    synthesis_id = synthesis_id.replace("_", "-")[:64]
+    if not synthesis_id[-1].isalnum():
+        synthesis_id = synthesis_id.rstrip("-_") + "0"
+    return synthesis_id
+
+
+async def _synthesize_segment(
+    client: httpx.AsyncClient,
+    synthesis_id: str,
+    text: str,
     avatar_character: str,
     avatar_style: str,
-    job_id: str | None = None,
-) -> tuple[str, str]:
+    on_tick: Callable[[], None] | None = None,
+    reuse_existing: bool = False,
+) -> bytes:
     """
-    Creates Azure batch avatar synthesis, polls until done, downloads mp4, uploads to Supabase.
+    One Azure batch avatar synthesis: submit, poll until done, download mp4.
 
-    Returns:
-        (public_url, storage_path)
+    An existing synthesis with the same id is adopted when reuse_existing
+    (ids embed the input hash, so same id == same inputs): a running one is
+    polled, a succeeded one is downloaded without re-rendering. Otherwise,
+    or if it failed / its result expired, it is deleted and resubmitted.
     """
-    if not avatar_character or not avatar_style:
-        raise RuntimeError("Missing avatar_character/avatar_style (Step 5).")
-
-    if not isinstance(AZURE_SPEECH_KEY, str) or not AZURE_SPEECH_KEY.strip():
-        raise RuntimeError("AZURE_SPEECH_KEY is missing/invalid")
-    if not isinstance(AZURE_SPEECH_REGION, str) or not AZURE_SPEECH_REGION.strip():
-        raise RuntimeError("AZURE_SPEECH_REGION is missing/invalid")
-
-    text = _extract_video_script(script_text)
-    if not text:
-        raise RuntimeError("No text found for video generation (VIDEO SCRIPT is empty)")
-
-    # Must be 3-64 chars, letters/numbers/-/_, start+end with alnum
-    synthesis_id = f"{lecture_id}-avatar".replace("_", "-")[:64]
-    if not synthesis_id[-1].isalnum():
-        synthesis_id = synthesis_id.rstrip("-_") + "0"
-
     base = f"https://{AZURE_SPEECH_REGION.strip()}.api.cognitive.microsoft.com"
     put_url = f"{base}/avatar/batchsyntheses/{synthesis_id}?api-version={API_VERSION}"
     get_url = f"{base}/avatar/batchsyntheses/{synthesis_id}?api-version={API_VERSION}"
 
+    auth = {"Ocp-Apim-Subscription-Key": AZURE_SPEECH_KEY.strip()}
     headers = {
-        "Ocp-Apim-Subscription-Key": AZURE_SPEECH_KEY.strip(),
+        **auth,
         "Content-Type": "application/json",
     }
 
@@ -97,58 +174,286 @@ async def generate_video_avatar_and_upload(
         },
     }
 
-    async with httpx.AsyncClient(timeout=180) as client:
-        r = await client.put(put_url, headers=headers, json=payload)
-        r.raise_for_status()
+    submit = True
+    er = await client.get(get_url, headers=auth, timeout=stage_timeout(AVATAR_REQUEST_TIMEOUT_S))
+    if er.status_code == 200:
+        if reuse_existing and er.json().get("status") in ("NotStarted", "Running", "Succeeded"):
+            submit = False
+        else:
+            dr = await client.delete(get_url, headers=auth, timeout=stage_timeout(AVATAR_REQUEST_TIMEOUT_S))
+            dr.raise_for_status()
+    elif er.status_code != 404:
+        er.raise_for_status()
+
+    # True while a synthesis we own / adopted is still rendering (and billing)
+    rendering = not submit
+    try:
+        while True:
+            if submit:
+                r = await client.put(
+                    put_url, headers=headers, json=payload, timeout=stage_timeout(AVATAR_REQUEST_TIMEOUT_S)
+                )
+                r.raise_for_status()
+                rendering = True
+
+            outputs_result_url = None
+
+            while True:
+                # Bounded by the request deadline instead of polling forever
+                gr = await client.get(get_url, headers=auth, timeout=stage_timeout(AVATAR_REQUEST_TIMEOUT_S))
+                gr.raise_for_status()
+                data = gr.json()
+
+                status = data.get("status")
+
+                if status in ("Succeeded", "Failed"):
+                    rendering = False
+                    outputs = data.get("outputs") or {}
+                    outputs_result_url = outputs.get("result")
+
+                    if status == "Failed":
+                        raise RuntimeError(f"Azure avatar batch synthesis failed: {data}")
+                    break
+
+                if on_tick:
+                    on_tick()
+
+                await asyncio.sleep(2)
+
+            if not outputs_result_url:
+                raise RuntimeError("Azure returned Succeeded but no outputs.result URL found")
+
+            vr = await client.get(outputs_result_url, headers=auth, timeout=stage_timeout(AVATAR_REQUEST_TIMEOUT_S))
+            if not submit and vr.status_code in (403, 404):
+                # Adopted result has expired: render once more from scratch
+                dr = await client.delete(get_url, headers=auth, timeout=stage_timeout(AVATAR_REQUEST_TIMEOUT_S))
+                dr.raise_for_status()
+                submit = True
+                continue
+            vr.raise_for_status()
+            return vr.content
+    except BaseException:
+        # Cancelled / deadline / sibling failed: stop the upstream render too,
+        # otherwise Azure keeps rendering (and billing) with nobody waiting
+        if rendering:
+            await _delete_synthesis_quietly(client, get_url, auth)
+        raise
+
+
+async def _delete_synthesis_quietly(client: httpx.AsyncClient, url: str, auth: dict):
+    try:
+        # Fixed short timeout: the request budget may already be spent
+        await asyncio.shield(client.delete(url, headers=auth, timeout=AVATAR_CLEANUP_TIMEOUT_S))
+    except BaseException as e:
+        logger.warning("Failed to delete Azure avatar synthesis %s: %s", url, e)
+
+
+def _upload_mp4(storage_path: str, video_bytes: bytes, input_hash: str | None) -> str:
+    supabase.storage.from_("lecture-assets").upload(
+        storage_path,
+        video_bytes,
+        file_options=upload_file_options("video/mp4", input_hash),
+    )
+    return supabase.storage.from_("lecture-assets").get_public_url(storage_path)
 
-        running_ticks = 0
-        outputs_result_url = None
 
-        while True:
-            gr = await client.get(
-                get_url,
-                headers={"Ocp-Apim-Subscription-Key": AZURE_SPEECH_KEY.strip()},
-            )
-            gr.raise_for_status()
-            data = gr.json()
+def _upload_manifest(storage_path: str, segments: list[dict], status: str) -> str:
+    """
+    status: "rendering" | "complete" | "failed"
+    """
+    manifest = {
+        "version": MANIFEST_VERSION,
+        "type": "segment_list",
+        "content_type": "video/mp4",
+        "status": status,
+        "segment_count": len(segments),
+        "segments": segments,
+    }
+    # Rewritten as segments finish, so never cached (storage3 sends this
+    # as "max-age=<value>", hence "0" rather than "no-cache")
+    options = upload_file_options("application/json", None)
+    options["cache-control"] = "0"
+    supabase.storage.from_("lecture-assets").upload(
+        storage_path,
+        json.dumps(manifest).encode("utf-8"),
+        file_options=options,
+    )
+    return supabase.storage.from_("lecture-assets").get_public_url(storage_path)
 
-            status = data.get("status")
 
-            if status in ("Succeeded", "Failed"):
-                outputs = data.get("outputs") or {}
-                outputs_result_url = outputs.get("result")
+def _load_manifest_entries(manifest_path: str, count: int) -> list[dict] | None:
+    """
+    Segment entries from an earlier manifest at the same content-hashed path,
+    or None if there is none / it does not match this segmentation.
+    """
+    try:
+        raw = supabase.storage.from_("lecture-assets").download(manifest_path)
+        manifest = json.loads(raw)
+    except Exception:
+        return None
+    entries = manifest.get("segments") if isinstance(manifest, dict) else None
+    if not isinstance(entries, list) or len(entries) != count:
+        return None
+    return entries
+
+
+def manifest_segment_paths(manifest_path: str) -> list[str]:
+    """
+    Storage paths of the segments listed in a segment-list manifest (for cleanup).
+    """
+    try:
+        raw = supabase.storage.from_("lecture-assets").download(manifest_path)
+        manifest = json.loads(raw)
+    except Exception:
+        return []
+    entries = manifest.get("segments") if isinstance(manifest, dict) else None
+    if not isinstance(entries, list):
+        return []
+    return [e["storage_path"] for e in entries if isinstance(e, dict) and e.get("storage_path")]
 
-                if status == "Failed":
-                    raise RuntimeError(f"Azure avatar batch synthesis failed: {data}")
-                break
 
-            if job_id:
-                running_ticks += 1
-                approx = 50 + min(40, running_ticks * 5)
-                supabase.table("lecture_jobs").update({"progress": approx, "status": "running"}).eq("id", job_id).execute()
+async def generate_video_avatar_and_upload(
+    lecture_id: str,
+    educator_id: str,
+    script_text: str,
+    avatar_character: str,
+    avatar_style: str,
+    on_progress: Callable[[int], None] | None = None,
+    input_hash: str | None = None,
+    on_playlist_ready: Callable[[str, str], None] | None = None,
+) -> tuple[str, str]:
+    """
+    Creates Azure batch avatar synthesis, polls until done, downloads mp4, uploads to Supabase.
+    With input_hash (see video_avatar_input_hash) files go to immutable,
+    content-hashed paths.
 
-            await asyncio.sleep(2)
+    Scripts longer than AVATAR_SEGMENT_MAX_CHARS are split at paragraph /
+    sentence boundaries and rendered as parallel batch syntheses (at most
+    AVATAR_MAX_CONCURRENCY at once). Each segment mp4 is uploaded as soon as
+    it is ready and listed in an ordered JSON manifest; on_playlist_ready
+    is called with the manifest (url, path) once segment 0 is uploaded so
+    playback can start before the full render finishes. If the render
+    fails, the manifest is rewritten with status "failed".
 
-        if not outputs_result_url:
-            raise RuntimeError("Azure returned Succeeded but no outputs.result URL found")
+    Returns:
+        (public_url, storage_path) of the mp4, or of the manifest when segmented
+    """
+    if not avatar_character or not avatar_style:
+        raise RuntimeError("Missing avatar_character/avatar_style (Step 5).")
 
-        vr = await client.get(
-            outputs_result_url,
-            headers={"Ocp-Apim-Subscription-Key": AZURE_SPEECH_KEY.strip()},
-        )
-        vr.raise_for_status()
-        video_bytes = vr.content
+    if not isinstance(AZURE_SPEECH_KEY, str) or not AZURE_SPEECH_KEY.strip():
+        raise RuntimeError("AZURE_SPEECH_KEY is missing/invalid")
+    if not isinstance(AZURE_SPEECH_REGION, str) or not AZURE_SPEECH_REGION.strip():
+        raise RuntimeError("AZURE_SPEECH_REGION is missing/invalid")
 
-    storage_path = f"{educator_id}/{lecture_id}/artifacts/video_avatar.mp4"
+    text = _extract_video_script(script_text)
+    if not text:
+        raise RuntimeError("No text found for video generation (VIDEO SCRIPT is empty)")
 
-    supabase.storage.from_("lecture-assets").upload(
-        storage_path,
-        video_bytes,
-        file_options={
-            "content-type": "video/mp4",
-            "x-upsert": "true",
-        },
-    )
+    segments = _split_into_segments(text)
+
+    # Short script: single synthesis, single mp4 (same as before segmenting)
+    if len(segments) <= 1:
+        running_ticks = 0
 
-    public_url = supabase.storage.from_("lecture-assets").get_public_url(storage_path)
-    return public_url, storage_path
+        def tick():
+            nonlocal running_ticks
+            if on_progress:
+                running_ticks += 1
+                on_progress(50 + min(40, running_ticks * 5))
+
+        async with httpx.AsyncClient(timeout=stage_timeout(AVATAR_REQUEST_TIMEOUT_S)) as client:
+            video_bytes = await _synthesize_segment(
+                client,
+                _synthesis_id(lecture_id, input_hash, None),
+                text,
+                avatar_character,
+                avatar_style,
+                on_tick=tick,
+                reuse_existing=input_hash is not None,
+            )
+
+        storage_path = artifact_storage_path(educator_id, lecture_id, "video_avatar", "mp4", input_hash)
+        public_url = _upload_mp4(storage_path, video_bytes, input_hash)
+        return public_url, storage_path
+
+    count = len(segments)
+    manifest_path = artifact_storage_path(educator_id, lecture_id, "video_avatar", "json", input_hash)
+    # A previous (failed/interrupted) run may already have uploaded some segments
+    entries = (_load_manifest_entries(manifest_path, count) if input_hash else None) or [
+        {"index": i, "status": "pending", "url": None, "storage_path": None} for i in range(count)
+    ]
+    ticks = [0] * count
+    done = [e.get("status") == "ready" for e in entries]
+    announced = False
+    semaphore = asyncio.Semaphore(max(1, AVATAR_MAX_CONCURRENCY))
+
+    def report():
+        if not on_progress:
+            return
+        # Finished segments count fully; running ones creep toward 90% of their share
+        share = sum(1.0 if done[i] else min(0.9, ticks[i] * 0.1) for i in range(count))
+        on_progress(50 + int(40 * share / count))
+
+    def announce(manifest_url: str):
+        nonlocal announced
+        if on_playlist_ready and not announced:
+            announced = True
+            on_playlist_ready(manifest_url, manifest_path)
+
+    async def render(client: httpx.AsyncClient, index: int):
+        def tick():
+            ticks[index] += 1
+            report()
+
+        async with semaphore:
+            video_bytes = await _synthesize_segment(
+                client,
+                _synthesis_id(lecture_id, input_hash, index),
+                segments[index],
+                avatar_character,
+                avatar_style,
+                on_tick=tick,
+                reuse_existing=input_hash is not None,
+            )
+
+        segment_path = artifact_storage_path(
+            educator_id, lecture_id, f"video_avatar-part{index:03d}", "mp4", input_hash
+        )
+        entries[index].update(
+            status="ready",
+            url=_upload_mp4(segment_path, video_bytes, input_hash),
+            storage_path=segment_path,
+        )
+        done[index] = True
+        report()
+
+        manifest_url = _upload_manifest(manifest_path, entries, "complete" if all(done) else "rendering")
+        if done[0]:
+            announce(manifest_url)
+
+    if any(done):
+        manifest_url = _upload_manifest(manifest_path, entries, "complete" if all(done) else "rendering")
+        if done[0]:
+            announce(manifest_url)
+        report()
+
+    async with httpx.AsyncClient(timeout=stage_timeout(AVATAR_REQUEST_TIMEOUT_S)) as client:
+        tasks = [asyncio.create_task(render(client, i)) for i in range(count) if not done[i]]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            # One segment failed: cancel the others; each deletes its
+            # in-flight Azure synthesis so it stops rendering upstream
+            for t in tasks:
+                t.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            # Ready segments stay listed so a resume can reuse them
+            try:
+                _upload_manifest(manifest_path, entries, "failed")
+            except Exception:
+                pass
+            raise
+
+    manifest_url = _upload_manifest(manifest_path, entries, "complete")
+    return manifest_url, manifest_path